@@ -83,8 +83,7 @@ $ pwd
 
 '''
 
-import sys, os
-from subprocess import check_output as run
+import sys, os, pipes
 from getopt import getopt, GetoptError
 
 import optutils
@@ -109,6 +108,8 @@ add_code('option')
 add_code('list'); error_codes['list'] = 126
 add_code('rcfile')
 add_code('dupname')
+add_code('checkpoint')
+add_code('timeout')
 
 
 def version():
@@ -117,10 +118,19 @@ def version():
     sys.exit(error_codes['version'])
 
 
-def parse_project(spec):
-    if os.path.sep in spec:
-        return spec.split(os.path.sep, 1)
-    return spec, ''
+def read_specs(f, sep):
+    '''Yields the non-empty specs in f split on sep. Newline separated specs
+    are stripped and yielded as they are read so results can stream back.
+    Other separators only split, the specs are kept byte for byte.'''
+    if sep == '\n':
+        for line in f:
+            spec = line.strip()
+            if spec:
+                yield spec
+    else:
+        for spec in f.read().split(sep):
+            if spec:
+                yield spec
 
 
 def load_project(project_name):
@@ -144,12 +154,25 @@ def check_update(src_dir, sudo, release):
                      # are r0.3. Therefore, we always compare to the local
                      # master
     remote = 'refs/remotes/origin/' + release
-    run(['sudo', 'git', '--git-dir=%s/swork/.git' % src_dir, 'fetch',
-      'origin', "%s:%s" % (release,remote)])
-    lmsg = run(['git', '--git-dir=%s/swork/.git' % src_dir, 'show-branch',
-      '--sha1-name', local])
-    rmsg = run(['git', '--git-dir=%s/swork/.git' % src_dir, 'show-branch',
-      '--sha1-name', remote])
+    git = ['git', '-c', 'credential.interactive=never',
+           '--git-dir=%s/swork/.git' % src_dir]
+    ## git must never stop to ask for credentials, sudo may need to ask for a
+    ## password so it has to keep the terminal. sudo resets the environment so
+    ## the no prompt setting is passed through env(1) on its command line.
+    env = dict(os.environ, GIT_TERMINAL_PROMPT='0')
+    fetch = git + ['fetch', 'origin', "%s:%s" % (release,remote)]
+    if sudo:
+        fetch = ['sudo', 'env', 'GIT_TERMINAL_PROMPT=0'] + fetch
+    try:
+        sworklib.runproc(fetch, 'git', interactive=sudo, env=env)
+        lmsg = sworklib.runproc(git + ['show-branch', '--sha1-name', local],
+          'git', capture=True, env=env)
+        rmsg = sworklib.runproc(git + ['show-branch', '--sha1-name', remote],
+          'git', capture=True, env=env)
+    except sworklib.Timeout as e:
+        log(str(e))
+        log('set SWORK_GIT_TIMEOUT to allow git more time')
+        sys.exit(error_codes['timeout'])
     def getcommit(msg):
         return msg.replace('[','').replace(']','').split(' ', 1)[0]
     if getcommit(lmsg) == getcommit(rmsg):
@@ -246,20 +269,104 @@ def main(argv, util, parser):
             log("already a project with the name %s" % name)
             util.usage(error_codes['dupname'])
 
-        if activate is None and not no_create:
-            activate = '.swork.activate'
-            sworklib.edittext(EDITOR, path=activate)
-        if deactivate is None and not no_create:
-            deactivate = '.swork.deactivate'
-            sworklib.edittext(EDITOR, path=deactivate)
-
-        activate = '' if activate is None else 'source %s' % activate
-        deactivate = '' if deactivate is None else 'source %s' % deactivate
+        try:
+            if activate is None and not no_create:
+                activate = '.swork.activate'
+                sworklib.edittext(EDITOR, path=activate)
+            if deactivate is None and not no_create:
+                deactivate = '.swork.deactivate'
+                sworklib.edittext(EDITOR, path=deactivate)
+        except sworklib.Timeout as e:
+            log(str(e))
+            log('set SWORK_EDITOR_TIMEOUT to allow the editor more time')
+            sys.exit(error_codes['timeout'])
 
         root = os.getcwd()
-        start = "echo '%s setup'; %s " % (name, activate)
-        end = "echo '%s teardown'; %s " % (name, deactivate)
-        sworklib.addproj(name, root, start, end)
+        sworklib.addprojs(
+            {name: sworklib.projentry(name, root, activate, deactivate)})
+
+
+    @util.command(
+        'find and add all the projects under a directory.',
+        '''
+        sw scan [-n] [--depth=<n>] [-j <n>] [-a <name>] [-d <name>] <dir>
+
+        Walks the directory tree under <dir> looking for directories with an
+        activate script (and optionally a deactivate script) and adds each one
+        as a project named after its directory, the same way `sw add
+        --no-create -a <name> -d <name>` run inside it would. All of the found
+        projects are written to the rc file at once. Directories whose name is
+        already a project are skipped. Hidden directories and symlinks are not
+        followed.
+
+        Examples
+
+            $ sw scan -n ~/code
+            $ sw scan --depth=2 -j 16 ~/code
+
+        Options
+            -h, help                  Show this help message
+            -n, dry-run               List what would be added, don't add it
+            --depth=<n>               Only look <n> levels below <dir>
+            -j, jobs=<n>              Directories listed concurrently [8]
+            -a, activate=<name>       Activate file name [.swork.activate]
+            -d, deactivate=<name>     Deactivate file name [.swork.deactivate]
+
+        Specs
+            <dir>
+                File system path to a directory.
+        ''',
+        'hnj:a:d:',
+        ['help', 'dry-run', 'depth=', 'jobs=', 'activate=', 'deactivate='],
+    )
+    def scan(argv, util, parser):
+
+        dry_run = False
+        depth = None
+        jobs = 8
+        activate = '.swork.activate'
+        deactivate = '.swork.deactivate'
+        opts, args = parser(argv)
+        for opt, arg in opts:
+            if opt in ('-h','--help',):
+                util.usage()
+            elif opt in ('-n','--dry-run',):
+                dry_run = True
+            elif opt in ('--depth',):
+                depth = util.parse_int(arg)
+            elif opt in ('-j','--jobs',):
+                jobs = util.parse_int(arg)
+            elif opt in ('-a','--activate',):
+                activate = arg
+            elif opt in ('-d','--deactivate',):
+                deactivate = arg
+
+        if len(args) != 1:
+            log("need to specify a directory to scan")
+            util.usage(error_codes['option'])
+        top = util.assert_dir_exists(args[0], nocreate=True)
+
+        rc = sworklib.loadrc(True)
+        if rc == False:
+            rc = dict()
+
+        projs = dict()
+        for root, act, deact in sworklib.scanprojects(
+                top, depth, max(jobs, 1), activate, deactivate):
+            name = os.path.basename(root)
+            if name in rc or name in projs:
+                log("skipping %s, already a project with the name %s" %
+                    (root, name))
+                continue
+            projs[name] = sworklib.projentry(name, root, act, deact)
+
+        for name in sorted(projs):
+            log('%s : %s' % (name, projs[name]['root']))
+        if dry_run:
+            sys.exit(error_codes['list'])
+        if projs:
+            sworklib.addprojs(projs)
+        log('added %d projects' % len(projs))
 
 
     @util.command(
@@ -312,46 +419,101 @@ def main(argv, util, parser):
     @util.command(
         'List all available projects.',
         '''
-        sw list
+        sw list [-z] [-r <dir>] [-s name|root] [-f <format>] [pattern]
+
+        Lists the projects in the .sworkrc file. When a pattern is given only
+        the projects whose name contains it (ignoring case) are listed.
+
+        Searches are served from an index kept next to the rc file
+        (.sworkrc.index). It is rebuilt whenever the rc changes.
+
+        Examples
 
-        Lists all the projects in the .sworkrc file.
+            $ sw list
+            $ sw list web
+            $ sw list -z wbsrv
+            $ sw list -r ~/code/work -s root -f tsv
 
         Options
 
             -h, help                 Print this message
+            -z, fuzzy                Match the pattern characters in order
+                                     instead of as a substring
+            -r, root=<dir>           Only projects whose root is in <dir>
+            -s, sort=<key>           Sort by "name" (default) or "root"
+            -f, format=<format>      One of
+                                       text  : name, root, start_cmd and
+                                               teardown_cmd (default)
+                                       names : just the names
+                                       tsv   : the four fields tab separated
+                                       json  : one json object per line
         ''',
-        'h',
-        ['help'],
+        'hzr:s:f:',
+        ['help', 'fuzzy', 'root=', 'sort=', 'format='],
     )
     def list(argv, util, parser):
         '''Lists all available projects.'''
 
+        fuzzy = False
+        root = None
+        sort = 'name'
+        format = 'text'
         opts, args = parser(argv)
         for opt, arg in opts:
             if opt in ('-h','--help',):
                 util.usage()
+            elif opt in ('-z','--fuzzy',):
+                fuzzy = True
+            elif opt in ('-r','--root',):
+                root = os.path.abspath(os.path.expanduser(arg))
+            elif opt in ('-s','--sort',):
+                sort = util.assert_in(arg, ('name', 'root'))
+            elif opt in ('-f','--format',):
+                format = util.assert_in(arg, ('text', 'names', 'tsv', 'json'))
+
+        if len(args) > 1:
+            log('list takes at most one pattern, you gave %s' % str(args))
+            util.usage(error_codes['option'])
+        pattern = args[0] if args else None
 
-        rc = sworklib.loadrc()
-        if rc == False:
+        idx = sworklib.loadindex()
+        if idx == False:
             log("Couldn't load the rcfile")
             util.usage(error_codes['rcfile'])
-        for name, proj in rc.iteritems():
-            log(name)
-            log(' '*4 + 'root : ' + proj['root'])
-            log(' '*4 + 'start_cmd : ' + proj['start_cmd'])
-            log(' '*4 + 'teardown_cmd : ' + proj['teardown_cmd'])
+        for i in idx.search(pattern, fuzzy, root, sort):
+            name = idx.names[i]
+            proj = idx.project(i)
+            if format == 'names':
+                log(name)
+            elif format == 'tsv':
+                log('\t'.join((name, proj['root'], proj['start_cmd'],
+                               proj['teardown_cmd'])))
+            elif format == 'json':
+                proj['name'] = name
+                log(sworklib.json.dumps(proj, sort_keys=True))
+            else:
+                log(name)
+                log(' '*4 + 'root : ' + proj['root'])
+                log(' '*4 + 'start_cmd : ' + proj['start_cmd'])
+                log(' '*4 + 'teardown_cmd : ' + proj['teardown_cmd'])
         sys.exit(error_codes['list'])
 
 
     @util.command(
         'Restores the original environment for the shell',
         '''
-        sw restore
+        sw restore [<checkpoint-name>]
 
         Restores the original shell environment. This unsets all the set
         envirnoment variables and sets the originals. It does not do anything to
         defined functions. Those must be handled manually in deactivate scripts.
 
+        When a checkpoint name is given the environment saved by
+        `sw checkpoint <checkpoint-name>` is restored instead. If the
+        checkpoint was made with a different project active the current
+        project's teardown command is run first. Otherwise only the variables
+        which differ from the checkpoint are set or unset.
+
         Options
             -h, help                 Print this message
         ''',
@@ -366,11 +528,82 @@ def main(argv, util, parser):
             if opt in ('-h','--help',):
                 util.usage()
 
+        if len(args) > 1:
+            log('restore takes at most one checkpoint name')
+            util.usage(error_codes['option'])
+
+        if args:
+            point = sworklib.loadcheckpoint(args[0])
+            if point is None:
+                log('there is no checkpoint named %s' % args[0])
+                sys.exit(error_codes['checkpoint'])
+            env, project_name = point
+            if project_name != sworklib.curproj():
+                sworklib.popproj()
+                ## the teardown may have changed anything so set everything
+                output(sworklib.patchenv(env, True))
+                output('cd %s' % (CWD))
+                sworklib.pushproj(project_name)
+            else:
+                output(sworklib.patchenv(env))
+            return
+
         sworklib.popproj()
         sworklib.restore_env()
         output('cd %s' % (CWD))
 
 
+    @util.command(
+        'save the environment as a named checkpoint',
+        '''
+        sw checkpoint [-l] [-d] <checkpoint-name>
+
+        Saves the current environment (and the active project) under a name so
+        it can be brought back later with `sw restore <checkpoint-name>`.
+        Checkpoints belong to the shell they were made in. Saving over an
+        existing name replaces it.
+
+        Examples
+
+            $ sw start project
+            $ sw checkpoint clean
+            $ export DEBUG=1
+            $ sw restore clean
+
+        Options
+            -h, help                 Print this message
+            -l, list                 List the checkpoints for this shell
+            -d, delete               Delete the named checkpoint
+        ''',
+        'hld',
+        ['help', 'list', 'delete']
+    )
+    def checkpoint(argv, util, parser):
+
+        delete = False
+        opts, args = parser(argv)
+        for opt, arg in opts:
+            if opt in ('-h','--help',):
+                util.usage()
+            elif opt in ('-l','--list',):
+                for name in sworklib.listcheckpoints():
+                    log(name)
+                sys.exit(error_codes['list'])
+            elif opt in ('-d','--delete',):
+                delete = True
+
+        if len(args) != 1:
+            log('checkpoint requires a checkpoint name, you gave %s' % str(args))
+            util.usage(error_codes['option'])
+
+        if delete:
+            if not sworklib.rmcheckpoint(args[0]):
+                log('there is no checkpoint named %s' % args[0])
+                sys.exit(error_codes['checkpoint'])
+        else:
+            sworklib.checkpoint(args[0])
+
+
     @util.command(
         'start work on a project',
         '''
@@ -409,7 +642,7 @@ def main(argv, util, parser):
 
         next = ''
         if cd:
-            project_name, next = parse_project(' '.join(args))
+            project_name, next = sworklib.parse_project(' '.join(args))
         else:
             project_name = ' '.join(args)
 
@@ -432,9 +665,16 @@ def main(argv, util, parser):
         'echo the path to the project ',
         '''
         sw path project[/path/to/sub/dir]
+        sw path --batch [-0] < specs
 
         Echos the path to the projects root or subdirectory.
 
+        With `--batch` the specs are read from stdin, one per line (or NUL
+        separated with `-0`), and the paths are echoed back in the same order
+        and with the same separator. The rc file is only loaded once for the
+        whole batch. A spec naming an undefined project is reported on stderr
+        and echoes an empty record so the output stays lined up with the input.
+
         Examples
 
             $ sw path project
@@ -442,25 +682,57 @@ def main(argv, util, parser):
             $ sw path project/path/to/sub/dir
             /abs/path/to/project/path/to/sub/dir
             $ cp file $(sw path project/sub/dir)
+            $ printf 'proj1\\nproj2/sub\\n' | sw path --batch
+            /abs/path/to/proj1
+            /abs/path/to/proj2/sub
 
         Options
 
             -h, help                        Print this message
+            -b, batch                       Read specs from stdin
+            -0, null                        Specs on stdin are NUL separated
         ''',
-        'h',
-        ['help']
+        'hb0',
+        ['help', 'batch', 'null']
     )
     def path(argv, util, parser):
 
+        batch = False
+        sep = '\n'
         opts, args = parser(argv)
         for opt, arg in opts:
             if opt in ('-h','--help',):
                 util.usage()
+            elif opt in ('-b','--batch',):
+                batch = True
+            elif opt in ('-0','--null',):
+                sep = '\0'
+
+        if batch:
+            if args:
+                log('path --batch reads specs from stdin, you gave %s' % str(args))
+                util.usage(error_codes['option'])
+            rc = sworklib.loadrc()
+            if rc == False:
+                log("Couldn't load the rcfile")
+                sys.exit(error_codes['rcfile'])
+            end = '\\n' if sep == '\n' else '\\0'
+            for spec in read_specs(sys.stdin, sep):
+                path = sworklib.project_path(rc, spec)
+                if path is None:
+                    project_name, next = sworklib.parse_project(spec)
+                    log('the project %s is not defined' % project_name)
+                    path = ''
+                ## quoted since the specs come from stdin, and each path is
+                ## ended with the input separator so paths with newlines in
+                ## them still line up under -0
+                output("printf '%%s%s' %s" % (end, pipes.quote(path)))
+            return
 
         if len(args) < 1:
             log('path requires a project_name, you gave %s' % str(args))
             util.usage(error_codes['option'])
-        project_name, next = parse_project(args[0])
+        project_name, next = sworklib.parse_project(args[0])
 
         proj = load_project(project_name)
         root = proj['root']
@@ -502,7 +774,7 @@ def main(argv, util, parser):
         if len(args) < 1:
             log('cd requires a project_name, you gave %s' % str(args))
             util.usage(error_codes['option'])
-        project_name, next = parse_project(args[0])
+        project_name, next = sworklib.parse_project(args[0])
 
         proj = load_project(project_name)
         root = proj['root']
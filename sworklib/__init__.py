@@ -1 +1,3 @@
 from lib import *
+from session import Session
+from index import Index
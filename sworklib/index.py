@@ -0,0 +1,175 @@
+#Swork - the project management utility.
+#Author: Tim Henderson
+#Contact: tim.tadh@gmail.com,
+    #or via EECS Department of Case Western Reserve University, Cleveland Ohio
+#Copyright: 2011 All Rights Reserved, Licensed under the GPLv2, see LICENSE
+
+'''
+A search index over the projects in the rc file used by `sw list`.
+
+Projects are numbered in name order. The index keeps the fields of every
+project in parallel lists, the project numbers in root order (with the sorted
+roots for bisecting) and a trigram -> project numbers map over the lower cased
+names. It is stored next to the rc file with marshal along with the stat
+signature of the rc it was built from, and is thrown away and rebuilt whenever
+that signature no longer matches.
+'''
+
+import os, re, marshal
+from bisect import bisect_left
+
+VERSION = 1
+
+
+def trigrams(s):
+    return set(s[i:i+3] for i in xrange(len(s) - 2))
+
+
+class Index(object):
+
+    def __init__(self, data):
+        self.data = data
+        self.names = data['names']
+        self.roots = data['roots']
+        self.starts = data['starts']
+        self.teardowns = data['teardowns']
+        self.byroot = data['byroot']
+        self.sortedroots = data['sortedroots']
+        self.grams = data['grams']
+
+    def __len__(self):
+        return len(self.names)
+
+    def project(self, i):
+        return {
+            'root': self.roots[i],
+            'start_cmd': self.starts[i],
+            'teardown_cmd': self.teardowns[i],
+        }
+
+    def save(self, path):
+        f = open(path, 'wb')
+        try:
+            marshal.dump(self.data, f)
+        finally:
+            f.close()
+
+    def substring(self, pattern):
+        '''Numbers (in name order) of the projects whose name contains the
+        pattern, ignoring case. Patterns of three or more characters are looked
+        up in the trigram map and only the candidates it gives are checked.'''
+        pattern = pattern.lower()
+        if len(pattern) < 3:
+            candidates = xrange(len(self.names))
+        else:
+            postings = list()
+            for gram in trigrams(pattern):
+                if gram not in self.grams:
+                    return list()
+                postings.append(self.grams[gram])
+            postings.sort(key=len)
+            candidates = set(postings[0])
+            for posting in postings[1:]:
+                candidates.intersection_update(posting)
+            candidates = sorted(candidates)
+        return [i for i in candidates if pattern in self.names[i].lower()]
+
+    def fuzzy(self, pattern):
+        '''Numbers (in name order) of the projects whose name contains the
+        characters of the pattern in order, ignoring case.'''
+        regex = re.compile(
+            '.*?'.join(re.escape(c) for c in pattern), re.IGNORECASE)
+        return [i for i, name in enumerate(self.names) if regex.search(name)]
+
+    def under(self, root):
+        '''Numbers (in root order) of the projects whose root is root or is
+        inside of it.'''
+        root = os.path.normpath(root)
+        prefix = root.rstrip(os.path.sep) + os.path.sep
+        found = list()
+        for j in xrange(bisect_left(self.sortedroots, root),
+                        len(self.sortedroots)):
+            r = self.sortedroots[j]
+            if r != root and not r.startswith(prefix):
+                if r > prefix:
+                    break
+                continue
+            found.append(self.byroot[j])
+        return found
+
+    def search(self, pattern=None, fuzzy=False, root=None, sort='name'):
+        '''Yields the numbers of the projects matching all of the given
+        filters in name or root order.'''
+        matches = None
+        if pattern:
+            if fuzzy:
+                matches = self.fuzzy(pattern)
+            else:
+                matches = self.substring(pattern)
+        if root is not None:
+            under = self.under(root)
+            if matches is None:
+                matches = under
+            else:
+                keep = set(matches)
+                matches = [i for i in under if i in keep]
+        if matches is None:
+            if sort == 'root':
+                order = self.byroot
+            else:
+                order = xrange(len(self.names))
+        elif sort == 'root':
+            keep = set(matches)
+            if root is not None:
+                order = matches
+            else:
+                order = (i for i in self.byroot if i in keep)
+        else:
+            order = sorted(matches)
+        for i in order:
+            yield i
+
+
+def build(rc, stat):
+    '''Builds the Index for the rc (as loaded by loadrc) whose file had the
+    given stat signature.'''
+    names = sorted(rc)
+    roots = [rc[name]['root'] for name in names]
+    byroot = sorted(xrange(len(names)), key=lambda i: roots[i])
+    grams = dict()
+    for i, name in enumerate(names):
+        for gram in trigrams(name.lower()):
+            grams.setdefault(gram, list()).append(i)
+    return Index({
+        'version': VERSION,
+        'stat': stat,
+        'names': names,
+        'roots': roots,
+        'starts': [rc[name]['start_cmd'] for name in names],
+        'teardowns': [rc[name]['teardown_cmd'] for name in names],
+        'byroot': byroot,
+        'sortedroots': [roots[i] for i in byroot],
+        'grams': grams,
+    })
+
+
+def load(path, stat):
+    '''Loads the Index at path. Returns None if there is no index there, it
+    cannot be read or it was built from an rc with a different stat
+    signature.'''
+    try:
+        f = open(path, 'rb')
+    except IOError:
+        return None
+    try:
+        try:
+            data = marshal.load(f)
+        except (EOFError, ValueError, TypeError):
+            return None
+    finally:
+        f.close()
+    if not isinstance(data, dict) or data.get('version') != VERSION:
+        return None
+    if data.get('stat') != stat:
+        return None
+    return Index(data)
@@ -4,7 +4,11 @@
     #or via EECS Department of Case Western Reserve University, Cleveland Ohio
 #Copyright: 2011 All Rights Reserved, Licensed under the GPLv2, see LICENSE
 
-import os, sys, tempfile, psutil, subprocess
+import os, sys, errno, stat, tempfile, psutil, zlib
+from multiprocessing.pool import ThreadPool
+
+import index
+from proc import runproc, Timeout
 
 ## A bunch of cheese to make this more portable around different json libs.
 try:
@@ -19,12 +23,26 @@ else:
         data = f.read()
         return json.read(data)
 
-shellpid = str(psutil.Process(os.getppid()).ppid())
-tmpdir = tempfile.gettempdir()
-datadir = os.path.join(tmpdir, 'swork')
 homedir = os.path.abspath(os.environ.get('HOME', ''))
 rcfile = os.path.join(homedir, '.sworkrc')
 
+## The shell pid and the data directory are only looked up when they are first
+## needed so importing sworklib does not touch the process table or the disk.
+_shellpid = None
+_datadir = None
+
+def getshellpid():
+    global _shellpid
+    if _shellpid is None:
+        _shellpid = str(psutil.Process(os.getppid()).ppid())
+    return _shellpid
+
+def getdatadir():
+    global _datadir
+    if _datadir is None:
+        _datadir = os.path.join(tempfile.gettempdir(), 'swork')
+    return _datadir
+
 def log(s):
     sys.stderr.write(str(s))
     sys.stderr.write('\n')
@@ -48,7 +66,8 @@ def edittext(editor, text='', path=None):
         touch(path)
     tty = os.ttyname(sys.stdin.fileno())
     stdout = open(tty, 'w')
-    subprocess.check_call([editor, path], stdout=stdout, stdin=sys.stdin)
+    runproc([editor, path], 'editor', interactive=True,
+            stdout=stdout, stdin=sys.stdin)
     f = open(path, 'r')
     s = f.read()
     f.close()
@@ -65,27 +84,94 @@ def touch(fname, times = None):
     finally:
         fhandle.close()
 
+def ttyname():
+    ## stdin is not a terminal when specs are piped in (eg. `sw path --batch`)
+    ## so fall back to the other standard streams before giving up.
+    for f in (sys.stdin, sys.stderr, sys.stdout):
+        try:
+            return os.ttyname(f.fileno())
+        except (OSError, AttributeError, ValueError):
+            pass
+    return 'notty'
+
+class State(object):
+    '''The per shell state directory. The tty and shell are looked up and the
+    directory is made at most once per invocation; every function below which
+    reads or writes a state file goes through the shared instance returned by
+    state().'''
+
+    def __init__(self, datadir=None, tty=None, shellpid=None):
+        if datadir is None: datadir = getdatadir()
+        if tty is None: tty = ttyname()
+        if shellpid is None: shellpid = getshellpid()
+        tty = tty.replace('/dev/', '').replace(os.path.sep, '_')
+        self.datadir = datadir
+        self.dir = os.path.join(datadir, tty + '_' + shellpid)
+        self.ready = False
+        self.created = set()
+
+    def ensure(self):
+        if self.ready: return self.dir
+        try:
+            os.mkdir(self.dir)
+        except OSError as e:
+            if e.errno == errno.ENOENT:
+                try:
+                    os.mkdir(self.datadir)
+                except OSError as e:
+                    ## another shell may have just made it
+                    if e.errno != errno.EEXIST:
+                        raise
+                os.mkdir(self.dir)
+            elif e.errno != errno.EEXIST:
+                raise
+        self.ready = True
+        return self.dir
+
+    def getfile(self, fname):
+        return os.path.join(self.ensure(), fname)
+
+    def usefiles(self, files):
+        '''Creates any of the files which do not exist yet. Existing files are
+        left alone.'''
+        for fname in files:
+            try:
+                fd = os.open(self.getfile(fname),
+                             os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666)
+            except OSError as e:
+                if e.errno != errno.EEXIST:
+                    raise
+            else:
+                os.close(fd)
+                self.created.add(fname)
+
+    def file_empty(self, fname):
+        if fname in self.created:
+            return True
+        return not bool(os.path.getsize(self.getfile(fname)))
+
+    def written(self, fname):
+        self.created.discard(fname)
+
+_state = None
+
+def state():
+    global _state
+    if _state is None:
+        _state = State()
+    return _state
+
 def ttydir():
-    tty = os.ttyname(sys.stdin.fileno())
-    tty = tty.replace('/dev/', '').replace(os.path.sep, '_')
-    tty = tty + '_' + shellpid
-    ttydir = os.path.join(datadir, tty)
-    if not os.path.exists(datadir):
-        os.mkdir(datadir)
-    if not os.path.exists(ttydir):
-        os.mkdir(ttydir)
-    return ttydir
+    return state().ensure()
 
 def usefiles(files):
-    d = ttydir()
-    for fname in files:
-        touch(os.path.join(d, fname))
+    state().usefiles(files)
 
 def getfile(fname):
-    return os.path.join(ttydir(), fname)
+    return state().getfile(fname)
 
 def file_empty(fname):
-    return not bool(os.path.getsize(getfile(fname)))
+    return state().file_empty(fname)
 
 def dumpenv():
     envname = getfile('env')
@@ -99,6 +185,7 @@ def dumpenv():
         env.write(data)
     finally:
         env.close()
+    state().written('env')
 
 def loadenv():
     env = open(getfile('env'), 'r')
@@ -112,6 +199,17 @@ def loadenv():
         d.update({name:value.decode('hex')})
     return d
 
+def envdiff(old, new):
+    '''Returns (changed, removed) where changed maps the names whose values
+    differ in new (or are new) to their values in new and removed lists the
+    names in old which are not in new.'''
+    changed = dict()
+    for name, val in new.iteritems():
+        if old.get(name) != val:
+            changed[name] = val
+    removed = [name for name in old if name not in new]
+    return changed, removed
+
 def setenv(env):
     collect = list()
     unset = 'unset %s;'
@@ -128,7 +226,27 @@ def setenv(env):
 def restore_env():
     output(setenv(loadenv()))
 
-def validaterc(data):
+## Variables the shell keeps up to date itself. They describe where the shell is
+## (and how deep), not the environment swork manages, so they are never copied
+## from one shell state to another.
+SHELL_VARS = ('PWD', 'OLDPWD', 'SHLVL', '_')
+
+def patchenv(env, full=False):
+    '''Shell commands which take the current environment to env touching only
+    the variables which differ (every variable in env if full is set). The
+    SHELL_VARS are left alone.'''
+    changed, removed = envdiff(os.environ, env)
+    if full: changed = env
+    collect = list()
+    for name in removed:
+        if name in SHELL_VARS: continue
+        collect.append('unset %s;' % name)
+    for name, val in changed.iteritems():
+        if name in SHELL_VARS: continue
+        collect.append("export %s='%s';" % (name, val.replace("'", "'\\''")))
+    return '\n'.join(collect)
+
+def validaterc(data, ignore_err=False):
     for name, proj in data.iteritems():
         if 'start_cmd' not in proj:
             if not ignore_err:
@@ -151,18 +269,19 @@ RC_NOT_FOUND_MSG = \
     output of `sw --help-config`
 '''
 
-def loadrc(ignore_err=False):
-    if not os.path.exists(rcfile):
+def loadrc(ignore_err=False, path=None):
+    if path is None: path = rcfile
+    if not os.path.exists(path):
         if not ignore_err:
-            log('no rc file exists looked at: %s' % rcfile)
+            log('no rc file exists looked at: %s' % path)
             log(RC_NOT_FOUND_MSG)
         return False
-    f = open(rcfile, 'r')
+    f = open(path, 'r')
     try:
         data = json_load(f)
     finally:
         f.close()
-    if validaterc(data):
+    if validaterc(data, ignore_err):
         return data
     return False
 
@@ -170,13 +289,76 @@ def saverc(rc):
     if validaterc(rc):
         with open(rcfile, 'w') as f:
             json.dump(rc, f, indent=4)
+        ## the rc is saved, a stale index is rebuilt by the next loadindex
+        try:
+            index.build(rc, rcstat(rcfile)).save(rcfile + '.index')
+        except IOError:
+            pass
         return True
     return False
 
+def rcstat(path=None):
+    '''The signature used to tell if the rc file has changed. None if it
+    does not exist.'''
+    if path is None: path = rcfile
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_mtime, st.st_size, st.st_ino)
+
+def loadindex(path=None):
+    '''Loads the search index for the rc file, rebuilding it if the rc has
+    changed since it was built. Returns False if the rc cannot be loaded.'''
+    if path is None: path = rcfile
+    stat = rcstat(path)
+    idx = index.load(path + '.index', stat)
+    if idx is None:
+        rc = loadrc(path=path)
+        if rc == False:
+            return False
+        idx = index.build(rc, stat)
+        try:
+            idx.save(path + '.index')
+        except IOError:
+            pass
+    return idx
+
+def parse_project(spec):
+    if os.path.sep in spec:
+        return spec.split(os.path.sep, 1)
+    return spec, ''
+
+def project_path(rc, spec):
+    '''Resolve a project[/sub/dir] spec against a loaded rc. Returns None if
+    the project is not defined.'''
+    project_name, next = parse_project(spec)
+    if project_name not in rc:
+        return None
+    root = rc[project_name]['root']
+    if next:
+        return os.path.join(root, next)
+    return root
+
+def projentry(name, root, activate=None, deactivate=None):
+    '''The rc entry `sw add` makes for a project whose (optional) activate and
+    deactivate scripts are sourced from its root.'''
+    activate = '' if activate is None else 'source %s' % activate
+    deactivate = '' if deactivate is None else 'source %s' % deactivate
+    return {
+        'root': root,
+        'start_cmd': "echo '%s setup'; %s " % (name, activate),
+        'teardown_cmd': "echo '%s teardown'; %s " % (name, deactivate),
+    }
+
 def addproj(name, root, start, end):
+    return addprojs({name:{'root':root, 'start_cmd':start, 'teardown_cmd':end}})
+
+def addprojs(projs):
+    '''Adds all of the projs (name -> rc entry) with a single rc write.'''
     rc = loadrc(True)
     if rc == False: rc = dict()
-    rc.update({name:{'root':root, 'start_cmd':start, 'teardown_cmd':end}})
+    rc.update(projs)
     return saverc(rc)
 
 def rmproj(name):
@@ -189,12 +371,23 @@ def pushproj(name):
     cur = open(getfile('cur'), 'w')
     cur.write(name)
     cur.close()
+    state().written('cur')
 
-def popproj():
+def curproj():
     cur = open(getfile('cur'), 'r')
-    name = cur.read().strip()
-    cur.close()
-    open(getfile('cur'), 'w').close()
+    try:
+        return cur.read().strip()
+    finally:
+        cur.close()
+
+def popproj():
+    cur = open(getfile('cur'), 'r+')
+    try:
+        name = cur.read().strip()
+        cur.seek(0)
+        cur.truncate()
+    finally:
+        cur.close()
 
     if not name: return
     rc = loadrc()
@@ -203,3 +396,146 @@ def popproj():
     output('cd %s' % (proj['root']))
     output(proj['teardown_cmd'])
 
+
+## Checkpoints are named restore points for a shell. They are kept in a single
+## zlib compressed json file as deltas against a base environment. A new base is
+## taken once the current one has CHECKPOINT_REBASE deltas against it or once a
+## delta grows past half the size of its base. Bases which no checkpoint refers
+## to are dropped. Values are hex encoded like dumpenv does.
+CHECKPOINT_REBASE = 8
+
+def hexenv(env):
+    return dict((name, val.encode('hex')) for name, val in env.iteritems())
+
+def unhexenv(env):
+    ## json hands the names back as unicode, make them bytes like the values
+    return dict((str(name), val.decode('hex')) for name, val in env.iteritems())
+
+def envsize(env):
+    return sum(len(name) + len(val) for name, val in env.iteritems())
+
+def loadcheckpoints():
+    try:
+        f = open(getfile('checkpoints'), 'rb')
+    except IOError as e:
+        if e.errno != errno.ENOENT:
+            raise
+        return {'next': 0, 'bases': {}, 'points': {}}
+    try:
+        data = f.read()
+    finally:
+        f.close()
+    return json.loads(zlib.decompress(data))
+
+def savecheckpoints(data):
+    used = set(point['base'] for point in data['points'].itervalues())
+    for base in data['bases'].keys():
+        if base not in used:
+            del data['bases'][base]
+    f = open(getfile('checkpoints'), 'wb')
+    try:
+        f.write(zlib.compress(json.dumps(data)))
+    finally:
+        f.close()
+
+def listcheckpoints():
+    return sorted(loadcheckpoints()['points'])
+
+def checkpoint(name, env=None):
+    '''Saves env (defaults to the current environment) and the current project
+    as the checkpoint name, replacing any checkpoint with that name.'''
+    if env is None: env = os.environ
+    env = hexenv(env)
+    data = loadcheckpoints()
+    points = data['points']
+    points.pop(name, None)
+    base = str(data['next'] - 1)
+    changed, removed = dict(), list()
+    if base in data['bases']:
+        changed, removed = envdiff(data['bases'][base], env)
+        refs = sum(1 for point in points.itervalues() if point['base'] == base)
+        if refs >= CHECKPOINT_REBASE or 2*envsize(changed) > envsize(env):
+            base = None
+    else:
+        base = None
+    if base is None:
+        base = str(data['next'])
+        data['next'] += 1
+        data['bases'][base] = env
+        changed, removed = dict(), list()
+    points[name] = {
+        'base': base,
+        'changed': changed,
+        'removed': removed,
+        'project': curproj(),
+    }
+    savecheckpoints(data)
+
+def loadcheckpoint(name):
+    '''Returns (env, project) for the checkpoint or None if there is no
+    checkpoint with that name.'''
+    data = loadcheckpoints()
+    if name not in data['points']:
+        return None
+    point = data['points'][name]
+    env = dict(data['bases'][point['base']])
+    for var in point['removed']:
+        del env[var]
+    env.update(point['changed'])
+    return unhexenv(env), point['project'].encode('utf-8')
+
+def rmcheckpoint(name):
+    data = loadcheckpoints()
+    if name not in data['points']:
+        return False
+    del data['points'][name]
+    savecheckpoints(data)
+    return True
+
+def scandir(path, activate, deactivate):
+    '''Looks in one directory for the activate (and deactivate) scripts.
+    Returns (found, subdirs) where found is (root, activate, deactivate) or None
+    and subdirs are the directories to look in next. Hidden directories and
+    symlinks are not followed.'''
+    try:
+        names = os.listdir(path)
+    except OSError:
+        return None, []
+    found = None
+    if activate in names:
+        found = (path, activate, deactivate if deactivate in names else None)
+    subdirs = list()
+    for name in names:
+        if name.startswith('.'): continue
+        sub = os.path.join(path, name)
+        try:
+            mode = os.lstat(sub).st_mode
+        except OSError:
+            continue
+        if stat.S_ISDIR(mode):
+            subdirs.append(sub)
+    return found, subdirs
+
+def scanprojects(top, depth=None, jobs=8,
+                 activate='.swork.activate', deactivate='.swork.deactivate'):
+    '''Walks the tree under top (to at most depth levels below it) a level at a
+    time, listing the directories of each level concurrently. Returns the
+    sorted (root, activate, deactivate) triples found, see scandir.'''
+    found = list()
+    level = [os.path.abspath(top)]
+    pool = ThreadPool(jobs)
+    try:
+        d = 0
+        while level and (depth is None or d <= depth):
+            results = pool.map(
+                lambda path: scandir(path, activate, deactivate), level)
+            level = list()
+            for f, subdirs in results:
+                if f is not None:
+                    found.append(f)
+                level.extend(subdirs)
+            d += 1
+    finally:
+        pool.close()
+        pool.join()
+    return sorted(found)
@@ -0,0 +1,157 @@
+#Swork - the project management utility.
+#Author: Tim Henderson
+#Contact: tim.tadh@gmail.com,
+    #or via EECS Department of Case Western Reserve University, Cleveland Ohio
+#Copyright: 2011 All Rights Reserved, Licensed under the GPLv2, see LICENSE
+
+'''
+Runs every external process swork starts (the editor, git and the shell used to
+evaluate activation scripts) so that none of them can wedge the user's shell.
+
+Each kind of process has a timeout in seconds which can be changed with the
+environment variable SWORK_<KIND>_TIMEOUT (eg. SWORK_GIT_TIMEOUT=10). A timeout
+of 0 means no limit. When a timeout expires the process is sent SIGTERM, then
+SIGKILL if it has not exited after KILL_GRACE seconds, and Timeout is raised.
+
+Non-interactive processes are started in their own process group with stdin
+from /dev/null. On Ctrl-C the whole group is killed before KeyboardInterrupt is
+passed on. Interactive processes (the editor) stay in the terminal's foreground
+group and are left to handle Ctrl-C themselves.
+
+Every call is recorded in `timings` as (kind, argv, seconds, returncode) and
+logged to stderr when SWORK_TIMINGS is set.
+'''
+
+import os, sys, signal, subprocess, threading, time
+
+TIMEOUTS = {
+    'editor': 3600,
+    'git': 60,
+    'activate': 60,
+}
+KILL_GRACE = 2
+POLL_MAX = .05
+
+timings = list()
+
+
+class Timeout(Exception):
+
+    def __init__(self, cmd, timeout):
+        Exception.__init__(self,
+            '%s did not finish within %s seconds' % (describe(cmd), timeout))
+        self.cmd = cmd
+        self.timeout = timeout
+
+
+def describe(cmd):
+    '''A one line description of cmd for messages.'''
+    s = ' '.join(cmd).split('\n', 1)[0]
+    if len(s) > 60 or '\n' in ' '.join(cmd):
+        s = s[:60] + ' ...'
+    return s
+
+
+def gettimeout(kind):
+    var = 'SWORK_%s_TIMEOUT' % kind.upper()
+    try:
+        timeout = float(os.environ.get(var, TIMEOUTS.get(kind, 0)))
+    except ValueError:
+        timeout = TIMEOUTS.get(kind, 0)
+    if timeout <= 0:
+        return None
+    return timeout
+
+
+def kill(p, group):
+    def send(sig):
+        try:
+            if group:
+                os.killpg(p.pid, sig)
+            else:
+                os.kill(p.pid, sig)
+        except OSError:
+            pass
+    send(signal.SIGTERM)
+    deadline = time.time() + KILL_GRACE
+    while p.poll() is None and time.time() < deadline:
+        time.sleep(.05)
+    if p.poll() is None:
+        send(signal.SIGKILL)
+
+
+def runproc(cmd, kind, interactive=False, capture=False, **kwargs):
+    '''Runs cmd (an argv list) to completion and returns its stdout if capture
+    is set. Extra keyword arguments are passed to subprocess.Popen. Raises
+    Timeout if it runs longer than the timeout for its kind and
+    subprocess.CalledProcessError if it exits non-zero.
+
+    Only this thread waits on or signals the process. It polls (backing off
+    to POLL_MAX seconds) so the timeout can be checked between polls. A
+    helper thread drains captured stdout so a full pipe can't stall it.'''
+    timeout = gettimeout(kind)
+    devnull = None
+    if not interactive:
+        kwargs['preexec_fn'] = os.setpgrp
+        if 'stdin' not in kwargs:
+            devnull = open(os.devnull, 'r')
+            kwargs['stdin'] = devnull
+    if capture:
+        kwargs['stdout'] = subprocess.PIPE
+    expired = False
+    exited = False
+    reader = None
+    chunks = list()
+    sigint = None
+    start = time.time()
+    p = subprocess.Popen(cmd, **kwargs)
+    try:
+        if capture:
+            reader = threading.Thread(
+                target=lambda: chunks.append(p.stdout.read()))
+            reader.daemon = True
+            reader.start()
+        if interactive:
+            ## the editor gets Ctrl-C from the terminal too, don't die under it
+            sigint = signal.signal(signal.SIGINT, lambda *args: None)
+        try:
+            delay = .001
+            while p.poll() is None:
+                if timeout is not None and time.time() - start >= timeout:
+                    expired = True
+                    kill(p, not interactive)
+                    p.wait()
+                    break
+                time.sleep(delay)
+                delay = min(2*delay, POLL_MAX)
+            exited = not expired
+        except KeyboardInterrupt:
+            kill(p, not interactive)
+            p.wait()
+            raise
+    finally:
+        if sigint is not None:
+            signal.signal(signal.SIGINT, sigint)
+        if reader is not None:
+            ## a killed process may have left children holding the pipe open,
+            ## don't wait on them forever (or close the pipe under the reader)
+            reader.join(None if exited else KILL_GRACE)
+            if not reader.is_alive():
+                p.stdout.close()
+        if devnull is not None:
+            devnull.close()
+        record(kind, cmd, time.time() - start, p.returncode)
+    if expired:
+        raise Timeout(cmd, timeout)
+    out = ''.join(chunks) if capture else None
+    if p.returncode != 0:
+        raise subprocess.CalledProcessError(p.returncode, cmd, out)
+    return out
+
+
+def record(kind, cmd, seconds, returncode):
+    timings.append((kind, cmd, seconds, returncode))
+    if os.environ.get('SWORK_TIMINGS'):
+        sys.stderr.write('swork: %s %.3fs exit=%s %s\n' %
+                         (kind, seconds, returncode, describe(cmd)))
+        sys.stderr.flush()
@@ -0,0 +1,139 @@
+#Swork - the project management utility.
+#Author: Tim Henderson
+#Contact: tim.tadh@gmail.com,
+    #or via EECS Department of Case Western Reserve University, Cleveland Ohio
+#Copyright: 2011 All Rights Reserved, Licensed under the GPLv2, see LICENSE
+
+'''
+An in process interface to swork for editors and other long running tools.
+
+    >>> from sworklib import Session
+    >>> s = Session()
+    >>> s.path('project/sub/dir')
+    '/abs/path/to/project/sub/dir'
+    >>> base = s.snapshot()
+    >>> changed, removed = s.diff(base, s.activate('project', base))
+
+Creating a Session does not touch the disk or spawn anything. The rc file is
+read on first use and reread only when it changes on disk. Activated
+environments are cached per project and starting environment.
+'''
+
+import os, pipes
+
+import lib, proc
+
+## The environment is dumped by bash itself (NUL separated name=value pairs of
+## the exported variables) so it does not depend on the calling interpreter,
+## which may be an editor or debugger embedding Python.
+ACTIVATE_SCRIPT = \
+'''export SW_PROJECT_ROOT=%(root)s
+cd %(root)s
+{ %(cmd)s
+} 1>&2
+for __swork_var in $(compgen -e); do
+    printf '%%s=%%s\\0' "$__swork_var" "${!__swork_var}"
+done
+'''
+
+
+class Session(object):
+
+    def __init__(self, rcfile=None, environ=None):
+        if environ is None:
+            environ = os.environ
+        if rcfile is None:
+            homedir = os.path.abspath(environ.get('HOME', ''))
+            rcfile = os.path.join(homedir, '.sworkrc')
+        self.rcfile = rcfile
+        self.environ = dict(environ)
+        self._rc = None
+        self._rcstat = None
+        self._activated = dict()
+
+    def loadrc(self):
+        '''Returns the rc as a dict. It is reread only if the file has changed
+        since the last load. A missing or invalid rc file loads as empty.'''
+        stat = lib.rcstat(self.rcfile)
+        if self._rc is None or stat != self._rcstat:
+            rc = False
+            if stat is not None:
+                try:
+                    rc = lib.loadrc(True, self.rcfile)
+                except ValueError:
+                    ## malformed (eg. half written) json
+                    rc = False
+            if rc == False:
+                rc = dict()
+            self._rc = rc
+            self._rcstat = stat
+            self._activated.clear()
+        return self._rc
+
+    def projects(self):
+        '''Sorted list of the names of the defined projects.'''
+        return sorted(self.loadrc())
+
+    def project(self, name):
+        '''The rc entry (root, start_cmd, teardown_cmd) for the project or None
+        if it is not defined.'''
+        return self.loadrc().get(name)
+
+    def root(self, name):
+        proj = self.project(name)
+        if proj is None:
+            return None
+        return proj['root']
+
+    def path(self, spec):
+        '''Resolves a project[/sub/dir] spec, as accepted by `sw path`, to an
+        absolute path. Returns None if the project is not defined.'''
+        return lib.project_path(self.loadrc(), spec)
+
+    def snapshot(self):
+        '''A copy of the environment this session was created with.'''
+        return dict(self.environ)
+
+    def activate(self, name, base=None):
+        '''Returns the environment (as a dict) which results from starting the
+        project in a shell whose environment is base (defaults to the session
+        environment). Returns None if the project is not defined. Raises
+        subprocess.CalledProcessError if the activation shell fails and
+        proc.Timeout if it runs past SWORK_ACTIVATE_TIMEOUT.'''
+        proj = self.project(name)
+        if proj is None:
+            return None
+        if base is None:
+            base = self.environ
+        key = (name, frozenset(base.iteritems()))
+        if key not in self._activated:
+            self._activated[key] = self._activate(proj, base)
+        return dict(self._activated[key])
+
+    def _activate(self, proj, base):
+        script = ACTIVATE_SCRIPT % {
+            'root': pipes.quote(proj['root']),
+            'cmd': proj['start_cmd'],
+        }
+        devnull = open(os.devnull, 'w')
+        try:
+            out = proc.runproc(['bash', '-c', script], 'activate',
+                capture=True, env=base, stderr=devnull)
+        finally:
+            devnull.close()
+        env = dict(item.split('=', 1) for item in out.split('\0') if item)
+        ## swork always cd's back to where the user was after sourcing a
+        ## start_cmd so the shell's own variables keep their starting values.
+        for name in lib.SHELL_VARS:
+            if name in base:
+                env[name] = base[name]
+            elif name in env:
+                del env[name]
+        return env
+
+    def diff(self, snapshot, env=None):
+        '''Returns (changed, removed) going from snapshot to env (defaults to
+        the session environment). See lib.envdiff.'''
+        if env is None:
+            env = self.environ
+        return lib.envdiff(snapshot, env)
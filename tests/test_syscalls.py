@@ -0,0 +1,151 @@
+#Swork - the project management utility.
+#Author: Tim Henderson
+#Contact: tim.tadh@gmail.com,
+    #or via EECS Department of Case Western Reserve University, Cleveland Ohio
+#Copyright: 2011 All Rights Reserved, Licensed under the GPLv2, see LICENSE
+
+'''
+Filesystem call budgets for the swork subcommands.
+
+Each test runs a subcommand once to set up the per shell state (as the user's
+first command in a shell would) and then runs it again as a fresh invocation
+with os.ttyname, os.path.exists, os.stat, os.mkdir, os.open and open counted.
+The test fails if any count goes over the subcommand's budget.
+
+The ttyname budget allows for the fallbacks ttyname() tries when the tests
+are not run from a terminal.
+
+Run with: python -m unittest discover tests
+'''
+
+import os, sys, json, shutil, tempfile, unittest, __builtin__
+from StringIO import StringIO
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import sworklib, sworklib.lib
+import swork
+
+BUDGETS = {
+    'restore': {'ttyname': 3, 'exists': 0, 'stat': 1, 'mkdir': 1, 'os.open': 2, 'open': 2},
+    'start': {'ttyname': 3, 'exists': 2, 'stat': 3, 'mkdir': 1, 'os.open': 2, 'open': 5},
+    'path': {'ttyname': 3, 'exists': 1, 'stat': 2, 'mkdir': 1, 'os.open': 2, 'open': 1},
+    'checkpoint': {'ttyname': 3, 'exists': 0, 'stat': 1, 'mkdir': 1, 'os.open': 2, 'open': 3},
+    'list': {'ttyname': 3, 'exists': 0, 'stat': 2, 'mkdir': 1, 'os.open': 2, 'open': 1},
+}
+
+
+class Counter(object):
+    '''Wraps the filesystem calls swork makes with counters.'''
+
+    CALLS = (
+        ('ttyname', os, 'ttyname'),
+        ('exists', os.path, 'exists'),
+        ('stat', os, 'stat'),
+        ('mkdir', os, 'mkdir'),
+        ('os.open', os, 'open'),
+        ('open', __builtin__, 'open'),
+    )
+
+    def __init__(self):
+        self.counts = dict((name, 0) for name, mod, attr in self.CALLS)
+        self.saved = list()
+
+    def wrap(self, name, f):
+        def counted(*args, **kwargs):
+            self.counts[name] += 1
+            return f(*args, **kwargs)
+        return counted
+
+    def __enter__(self):
+        for name, mod, attr in self.CALLS:
+            f = getattr(mod, attr)
+            self.saved.append((mod, attr, f))
+            setattr(mod, attr, self.wrap(name, f))
+        return self
+
+    def __exit__(self, *exc):
+        for mod, attr, f in self.saved:
+            setattr(mod, attr, f)
+        self.saved = list()
+
+
+class TestSyscallBudget(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.home = os.path.join(self.tmp, 'home')
+        self.tmpdir = os.path.join(self.tmp, 'tmp')
+        self.root = os.path.join(self.tmp, 'proj')
+        for d in (self.home, self.tmpdir, self.root):
+            os.mkdir(d)
+        rcfile = os.path.join(self.home, '.sworkrc')
+        with open(rcfile, 'w') as f:
+            json.dump({'proj': {
+                'root': self.root,
+                'start_cmd': "echo 'proj setup'",
+                'teardown_cmd': "echo 'proj teardown'",
+            }}, f)
+        self.environ = dict(os.environ)
+        os.environ.update({
+            'HOME': self.home,
+            'TMPDIR': self.tmpdir,
+            'PS1': '$ ',
+            'PWD': self.root,
+        })
+        self.rcfile = sworklib.lib.rcfile
+        sworklib.lib.rcfile = rcfile
+        tempfile.tempdir = None
+        sworklib.lib._datadir = None
+
+    def tearDown(self):
+        os.environ.clear()
+        os.environ.update(self.environ)
+        sworklib.lib.rcfile = self.rcfile
+        tempfile.tempdir = None
+        sworklib.lib._datadir = None
+        sworklib.lib._state = None
+        shutil.rmtree(self.tmp)
+
+    def invoke(self, argv):
+        '''Runs swork as a fresh invocation would: the per invocation state is
+        dropped and the swork module is reimported.'''
+        sworklib.lib._state = None
+        stdout, stderr = sys.stdout, sys.stderr
+        sys.stdout, sys.stderr = StringIO(), StringIO()
+        try:
+            reload(swork)
+            swork.main(argv)
+        except SystemExit:
+            pass
+        finally:
+            sys.stdout, sys.stderr = stdout, stderr
+
+    def check(self, command, argv):
+        self.invoke(argv)
+        with Counter() as counter:
+            self.invoke(argv)
+        budget = BUDGETS[command]
+        for name, count in sorted(counter.counts.iteritems()):
+            self.assertTrue(count <= budget[name],
+                '`sw %s` made %d %s calls, its budget is %d' %
+                (' '.join(argv), count, name, budget[name]))
+
+    def test_restore(self):
+        self.check('restore', ['restore'])
+
+    def test_start(self):
+        self.check('start', ['start', 'proj'])
+
+    def test_path(self):
+        self.check('path', ['path', 'proj/sub'])
+
+    def test_checkpoint(self):
+        self.check('checkpoint', ['checkpoint', 'point'])
+
+    def test_list(self):
+        self.check('list', ['list'])
+
+
+if __name__ == '__main__':
+    unittest.main()